@@ -7,10 +7,12 @@ app.py - 棒球 AI 統一分析平台
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from datetime import date
+import io
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -19,7 +21,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # 導入自定義模組
-from src.data_fetcher import get_game_data, get_mlb_teams, get_batters_from_game, get_player_history
+from src.data_fetcher import get_game_data, get_mlb_teams, get_batters_from_game, get_players_history
 from src.data_engine import get_full_analysis
 from src.narrative_engine import extract_key_moments, generate_game_narrative, generate_player_analysis
 from src.narrative_logic import generate_season_narrative, generate_quick_summary
@@ -32,8 +34,17 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# 賽季對應的日期範圍
+SEASON_DATES = {
+    "2024 賽季": ("2024-03-20", "2024-10-31"),
+    "2023 賽季": ("2023-03-30", "2023-10-01"),
+    "2022 賽季": ("2022-04-07", "2022-10-05"),
+    "2021 賽季": ("2021-04-01", "2021-10-03"),
+    "2020 賽季": ("2020-07-23", "2020-09-27"),
+}
+
 # 自定義 CSS - 現代化美化設計
-st.markdown("""
+_CSS_STYLE = """
 <style>
     /* 全局樣式 */
     @import url('https://fonts.googleapis.com/css2?family=Noto+Sans+TC:wght@400;500;700&display=swap');
@@ -189,7 +200,11 @@ st.markdown("""
     #MainMenu {visibility: hidden;}
     footer {visibility: hidden;}
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# Streamlit 每次 rerun 都會清掉畫面元素，CSS 仍需每輪注入；
+# 但字串本身維持模組常數，不在函式內重組
+st.markdown(_CSS_STYLE, unsafe_allow_html=True)
 
 
 def get_api_key():
@@ -200,6 +215,67 @@ def get_api_key():
     return st.session_state.get('api_key', '')
 
 
+# ==================== 快取層 ====================
+# 以 st.cache_data 包裝網路/重運算函式，重複查詢直接命中記憶體快取
+
+@st.cache_data(ttl=86400, show_spinner=False)
+def cached_get_full_analysis(last_name: str, first_name: str, start_date: str, end_date: str):
+    """快取季度分析結果 (同球員同賽季重查免去 Statcast 網路成本)"""
+    return get_full_analysis(last_name, first_name, start_date, end_date)
+
+
+@st.cache_data(ttl=None)
+def get_team_mappings():
+    """回傳 (代碼→隊名, 隊名→代碼) 雙向對照，正反查都是 O(1)"""
+    teams = get_mlb_teams()
+    code_by_name = dict(zip(teams.values(), teams.keys()))
+    return teams, code_by_name
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def cached_get_game_data(game_date: str, team_code: str):
+    """快取單日比賽資料"""
+    return get_game_data(game_date, team_code)
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def cached_get_players_history(batter_ids: tuple, game_date: str):
+    """快取整批打者的歷史資料 (一次下載 + groupby，全隊共用)"""
+    return get_players_history(batter_ids, game_date)
+
+
+def store_game_df(df):
+    """
+    將比賽 DataFrame 壓縮成 parquet bytes 存入 session_state
+
+    Streamlit 每次 rerun 都會重新序列化 session_state 內的大物件，
+    存壓縮後的 bytes 比存整個 DataFrame 便宜得多
+    """
+    if df is None:
+        st.session_state.game_df_parquet = None
+        return
+    buf = io.BytesIO()
+    df.to_parquet(buf, compression='zstd')
+    st.session_state.game_df_parquet = buf.getvalue()
+
+
+@st.cache_data(show_spinner=False)
+def _decode_game_df(parquet_bytes: bytes) -> pd.DataFrame:
+    """解碼 parquet bytes (以 bytes hash 為 key，同一 rerun 內重複讀取免費)"""
+    return pd.read_parquet(io.BytesIO(parquet_bytes))
+
+
+@st.cache_data(show_spinner=False)
+def _batter_game_groups(parquet_bytes: bytes) -> dict:
+    """
+    當日比賽依打者預先分組 (與歷史資料的 groupby dict 同一套做法)
+
+    切換打者只查一次 dict，不必每次對整場比賽重算布林遮罩
+    """
+    df = _decode_game_df(parquet_bytes)
+    return dict(iter(df.groupby('batter', sort=False)))
+
+
 def main():
     # 標題
     st.markdown('<p class="main-header">⚾ 棒球 AI 統一分析平台</p>', unsafe_allow_html=True)
@@ -243,8 +319,8 @@ def game_analysis_ui(api_key):
     st.markdown("選擇日期和球隊，生成比賽戰報並分析球員表現")
     
     # Session State 初始化
-    if 'game_df' not in st.session_state:
-        st.session_state.game_df = None
+    if 'game_df_parquet' not in st.session_state:
+        st.session_state.game_df_parquet = None
     if 'batters' not in st.session_state:
         st.session_state.batters = {}
     if 'narrative_result' not in st.session_state:
@@ -261,17 +337,17 @@ def game_analysis_ui(api_key):
         game_date = st.date_input("比賽日期", date.today())
         
     with col2:
-        teams = get_mlb_teams()
+        teams, code_by_name = get_team_mappings()
         team_name = st.selectbox("選擇球隊", list(teams.values()))
-        team_code = [k for k, v in teams.items() if v == team_name][0]
+        team_code = code_by_name[team_name]
     
     if st.button("🎯 生成比賽戰報", key="generate_game_report"):
         if not api_key:
             st.error("請在 .env 檔案中設定 OPENAI_API_KEY")
         else:
             with st.spinner("抓取資料並分析比賽..."):
-                df = get_game_data(str(game_date), team_code)
-                st.session_state.game_df = df
+                df = cached_get_game_data(str(game_date), team_code)
+                store_game_df(df)
                 
                 if df is None:
                     st.error(f"找不到 {team_name} 在 {game_date} 的比賽資料")
@@ -309,26 +385,34 @@ def game_analysis_ui(api_key):
             with st.expander("查看關鍵時刻數據"):
                 st.json(st.session_state.moments_data)
     
-    # 球員策略分析區
+    # 球員策略分析區 (獨立 fragment：此區互動不會重跑整個頁面)
+    player_strategy_fragment(api_key, game_date)
+
+
+@st.fragment
+def player_strategy_fragment(api_key, game_date):
+    """球員策略分析區 (fragment 內的互動只重跑這個區塊)"""
     st.markdown("---")
     st.markdown("### 🎯 球員策略分析")
     st.markdown("選擇比賽中的打者，分析投手對他的投球策略")
-    
+
     if st.session_state.batters:
-        batter_options = {v: k for k, v in st.session_state.batters.items()}
+        batters = st.session_state.batters
+        batter_options = dict(zip(batters.values(), batters.keys()))
         selected_batter_name = st.selectbox("選擇打者", list(batter_options.keys()))
         selected_batter_id = batter_options[selected_batter_name]
         
         if st.button("🔍 分析策略", key="analyze_player_strategy"):
             if not api_key:
                 st.error("請在 .env 檔案中設定 OPENAI_API_KEY")
-            elif st.session_state.game_df is None:
+            elif st.session_state.game_df_parquet is None:
                 st.error("請先生成比賽戰報")
             else:
                 with st.spinner(f"分析 {selected_batter_name} 的對戰策略..."):
-                    game_df = st.session_state.game_df
-                    batter_game_df = game_df[game_df['batter'] == selected_batter_id]
-                    history_df = get_player_history(selected_batter_id, str(game_date))
+                    batter_groups = _batter_game_groups(st.session_state.game_df_parquet)
+                    batter_game_df = batter_groups.get(selected_batter_id, pd.DataFrame())
+                    histories = cached_get_players_history(tuple(sorted(batters.keys())), str(game_date))
+                    history_df = histories.get(selected_batter_id)
                     analysis = generate_player_analysis(batter_game_df, history_df, selected_batter_name, api_key)
                     st.session_state.player_analysis_result = analysis
                     st.session_state.analyzed_player_name = selected_batter_name
@@ -354,16 +438,7 @@ def season_diagnosis_ui(api_key):
     """季度診斷 UI"""
     st.header("📊 季度診斷報告")
     st.markdown("分析球員整個賽季的表現變化 (前10場 / 季中10場 / 最後10場)")
-    
-    # 賽季對應的日期範圍
-    SEASON_DATES = {
-        "2024 賽季": ("2024-03-20", "2024-10-31"),
-        "2023 賽季": ("2023-03-30", "2023-10-01"),
-        "2022 賽季": ("2022-04-07", "2022-10-05"),
-        "2021 賽季": ("2021-04-01", "2021-10-03"),
-        "2020 賽季": ("2020-07-23", "2020-09-27"),
-    }
-    
+
     # 輸入區
     col1, col2, col3 = st.columns(3)
     
@@ -381,7 +456,7 @@ def season_diagnosis_ui(api_key):
         with st.spinner(f"正在分析 {first_name} {last_name} 的數據..."):
             try:
                 season_year = selected_season.split()[0]
-                diagnosis = get_full_analysis(last_name, first_name, start_date, end_date)
+                diagnosis = cached_get_full_analysis(last_name, first_name, start_date, end_date)
                 
                 st.session_state['diagnosis'] = diagnosis
                 st.session_state['player_name'] = f"{first_name} {last_name}"
@@ -410,45 +485,19 @@ def season_diagnosis_ui(api_key):
         st.header("📈 數據視覺化")
         
         segments = diagnosis['analysis_segments']
+        metric_df = build_metric_frame(segments)
         
         chart_tab1, chart_tab2, chart_tab3 = st.tabs(["🔥 物理指標", "📊 表現指標", "💯 進階指標"])
-        
+
         with chart_tab1:
-            col1, col2 = st.columns(2)
-            with col1:
-                fig_speed = create_bar_chart(segments, 'avg_launch_speed', '平均初速 (mph)', '三段時期初速對比')
-                st.plotly_chart(fig_speed, use_container_width=True)
-            with col2:
-                fig_hh = create_bar_chart(segments, 'hard_hit_rate', 'Hard Hit Rate (%)', '三段時期 Hard Hit 對比')
-                st.plotly_chart(fig_hh, use_container_width=True)
-            
-            fig_trend = create_trend_chart(segments)
-            st.plotly_chart(fig_trend, use_container_width=True)
-        
+            physical_charts_fragment(segments, metric_df)
+
         with chart_tab2:
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                fig_hr = create_bar_chart(segments, 'home_runs', '全壘打數', '全壘打對比')
-                st.plotly_chart(fig_hr, use_container_width=True)
-            with col2:
-                fig_k = create_bar_chart(segments, 'k_rate', '三振率 (%)', '三振率對比')
-                st.plotly_chart(fig_k, use_container_width=True)
-            with col3:
-                fig_bb = create_bar_chart(segments, 'bb_rate', '保送率 (%)', '保送率對比')
-                st.plotly_chart(fig_bb, use_container_width=True)
-        
+            performance_charts_fragment(metric_df)
+
         with chart_tab3:
-            col1, col2 = st.columns(2)
-            with col1:
-                fig_woba = create_bar_chart(segments, 'woba', 'wOBA', 'wOBA 對比')
-                st.plotly_chart(fig_woba, use_container_width=True)
-            with col2:
-                fig_babip = create_bar_chart(segments, 'babip', 'BABIP', 'BABIP 對比')
-                st.plotly_chart(fig_babip, use_container_width=True)
-            
-            fig_radar = create_radar_chart(segments)
-            st.plotly_chart(fig_radar, use_container_width=True)
-        
+            advanced_charts_fragment(segments, metric_df)
+
         # AI 診斷報告
         st.markdown("---")
         st.header("🤖 AI 專業診斷報告")
@@ -474,17 +523,77 @@ def season_diagnosis_ui(api_key):
             st.json(diagnosis)
 
 
-def create_bar_chart(segments: dict, metric: str, y_label: str, title: str):
-    """建立長條圖"""
-    data = {
-        '時期': ['Early\n(前10場)', 'Mid\n(季中10場)', 'Late\n(最後10場)'],
-        '數值': [
-            segments['early'].get(metric, 0) or 0,
-            segments['mid'].get(metric, 0) or 0,
-            segments['late'].get(metric, 0) or 0
-        ]
-    }
-    
+# 各圖表分頁獨立成 fragment：其他區塊的互動不會觸發這裡重建
+
+@st.fragment
+def physical_charts_fragment(segments: dict, metric_df: pd.DataFrame):
+    """物理指標分頁 (初速 / Hard Hit / 趨勢線)"""
+    col1, col2 = st.columns(2)
+    with col1:
+        fig_speed = create_bar_chart(metric_df, 'avg_launch_speed', '平均初速 (mph)', '三段時期初速對比')
+        st.plotly_chart(fig_speed, use_container_width=True)
+    with col2:
+        fig_hh = create_bar_chart(metric_df, 'hard_hit_rate', 'Hard Hit Rate (%)', '三段時期 Hard Hit 對比')
+        st.plotly_chart(fig_hh, use_container_width=True)
+
+    fig_trend = create_trend_chart(segments)
+    st.plotly_chart(fig_trend, use_container_width=True)
+
+
+@st.fragment
+def performance_charts_fragment(metric_df: pd.DataFrame):
+    """表現指標分頁 (全壘打 / 三振率 / 保送率)"""
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        fig_hr = create_bar_chart(metric_df, 'home_runs', '全壘打數', '全壘打對比')
+        st.plotly_chart(fig_hr, use_container_width=True)
+    with col2:
+        fig_k = create_bar_chart(metric_df, 'k_rate', '三振率 (%)', '三振率對比')
+        st.plotly_chart(fig_k, use_container_width=True)
+    with col3:
+        fig_bb = create_bar_chart(metric_df, 'bb_rate', '保送率 (%)', '保送率對比')
+        st.plotly_chart(fig_bb, use_container_width=True)
+
+
+@st.fragment
+def advanced_charts_fragment(segments: dict, metric_df: pd.DataFrame):
+    """進階指標分頁 (wOBA / BABIP / 雷達圖)"""
+    col1, col2 = st.columns(2)
+    with col1:
+        fig_woba = create_bar_chart(metric_df, 'woba', 'wOBA', 'wOBA 對比')
+        st.plotly_chart(fig_woba, use_container_width=True)
+    with col2:
+        fig_babip = create_bar_chart(metric_df, 'babip', 'BABIP', 'BABIP 對比')
+        st.plotly_chart(fig_babip, use_container_width=True)
+
+    fig_radar = create_radar_chart(segments)
+    st.plotly_chart(fig_radar, use_container_width=True)
+
+
+# 長條圖展示的指標 (一次攤平，七張圖共用同一張 long-format 表)
+_BAR_PERIODS = ['Early\n(前10場)', 'Mid\n(季中10場)', 'Late\n(最後10場)']
+_BAR_METRICS = ('avg_launch_speed', 'hard_hit_rate', 'home_runs', 'k_rate', 'bb_rate', 'woba', 'babip')
+
+
+@st.cache_data(show_spinner=False)
+def build_metric_frame(segments: dict) -> pd.DataFrame:
+    """把各指標 × 三段時期一次攤成 long-format 表，免去每張圖各自翻字典"""
+    values = np.array(
+        [[segments[p].get(m) or 0 for p in ('early', 'mid', 'late')] for m in _BAR_METRICS],
+        dtype=float
+    )
+    return pd.DataFrame({
+        '時期': np.tile(_BAR_PERIODS, len(_BAR_METRICS)),
+        'metric': np.repeat(_BAR_METRICS, 3),
+        '數值': values.ravel(),
+    })
+
+
+@st.cache_data(show_spinner=False)
+def create_bar_chart(metric_df: pd.DataFrame, metric: str, y_label: str, title: str):
+    """建立長條圖 (從預先攤平的指標表切出單一指標；以內容為 key 快取)"""
+    data = metric_df[metric_df['metric'] == metric]
+
     fig = px.bar(
         data,
         x='時期',
@@ -509,8 +618,9 @@ def create_bar_chart(segments: dict, metric: str, y_label: str, title: str):
     return fig
 
 
+@st.cache_data(show_spinner=False)
 def create_trend_chart(segments: dict):
-    """建立趨勢線圖"""
+    """建立趨勢線圖 (以診斷內容為 key 快取)"""
     metrics = ['avg_launch_speed', 'hard_hit_rate', 'whiff_rate']
     labels = ['平均初速 (mph)', 'Hard Hit Rate (%)', 'Whiff Rate (%)']
     
@@ -556,36 +666,42 @@ def create_trend_chart(segments: dict):
     return fig
 
 
+# 雷達圖五軸的取值欄位與正規化上下界 (k_rate 反向：越低越好)
+_RADAR_METRICS = ('avg_launch_speed', 'hard_hit_rate', 'bb_rate', 'k_rate', 'max_hit_distance')
+_RADAR_MINS = np.array([80, 20, 0, 10, 350], dtype=float)
+_RADAR_MAXS = np.array([100, 60, 15, 35, 450], dtype=float)
+_RADAR_INVERT = np.array([False, False, False, True, False])
+_RADAR_CATEGORIES = ['初速', 'Hard Hit', '選球', '抗三振', '長打力']
+_RADAR_COLORS = [
+    ('rgba(0,210,255,0.3)', 'rgb(0,210,255)'),
+    ('rgba(168,85,247,0.3)', 'rgb(168,85,247)'),
+    ('rgba(244,63,94,0.3)', 'rgb(244,63,94)')
+]
+_SEGMENT_LABELS = ['Early (前10場)', 'Mid (季中10場)', 'Late (最後10場)']
+
+
+@st.cache_data(show_spinner=False)
 def create_radar_chart(segments: dict):
-    """建立雷達圖"""
-    categories = ['初速', 'Hard Hit', '選球', '抗三振', '長打力']
-    
-    def normalize(val, min_val, max_val):
-        if val is None:
-            return 50
-        return min(100, max(0, (val - min_val) / (max_val - min_val) * 100))
-    
+    """建立雷達圖 (以診斷內容為 key 快取)"""
+    categories = _RADAR_CATEGORIES
+
     def get_scores(segment):
-        return [
-            normalize(segment.get('avg_launch_speed'), 80, 100),
-            normalize(segment.get('hard_hit_rate'), 20, 60),
-            normalize(segment.get('bb_rate'), 0, 15),
-            100 - normalize(segment.get('k_rate'), 10, 35),
-            normalize(segment.get('max_hit_distance'), 350, 450)
-        ]
-    
+        vals = np.array(
+            [segment.get(k) if segment.get(k) is not None else np.nan
+             for k in _RADAR_METRICS],
+            dtype=float
+        )
+        scores = np.clip((vals - _RADAR_MINS) / (_RADAR_MAXS - _RADAR_MINS) * 100, 0, 100)
+        scores = np.where(_RADAR_INVERT, 100 - scores, scores)
+        scores = np.where(np.isnan(vals), 50, scores)
+        return scores.tolist()
+
     fig = go.Figure()
-    
-    colors = [
-        ('rgba(0,210,255,0.3)', 'rgb(0,210,255)'),
-        ('rgba(168,85,247,0.3)', 'rgb(168,85,247)'),
-        ('rgba(244,63,94,0.3)', 'rgb(244,63,94)')
-    ]
-    
+
     for (segment_key, segment_data), (fill_color, line_color), name in zip(
         segments.items(),
-        colors,
-        ['Early (前10場)', 'Mid (季中10場)', 'Late (最後10場)']
+        _RADAR_COLORS,
+        _SEGMENT_LABELS
     ):
         scores = get_scores(segment_data)
         scores.append(scores[0])
@@ -8,49 +8,148 @@ Module A: The Data Slicer (數據切片器)
 Module B: The Metric Aggregator (指標聚合器)
 """
 
+import shelve
 import pandas as pd
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
 from pybaseball import playerid_lookup, statcast_batter
 from typing import Dict, Tuple, Any
 
+# 磁碟快取目錄 (球員 ID 對照表跨執行期間有效)
+_CACHE_DIR = Path(__file__).parent.parent / '.cache'
+_CACHE_DIR.mkdir(exist_ok=True)
+_PLAYER_ID_DB = str(_CACHE_DIR / 'playerid')
 
+# 打數 (At Bat) 認定事件
+AT_BAT_EVENTS = frozenset({
+    'single', 'double', 'triple', 'home_run',
+    'field_out', 'strikeout', 'double_play',
+    'grounded_into_double_play', 'force_out',
+    'fielders_choice', 'fielders_choice_out'
+})
+
+# 安打事件
+HIT_EVENTS = frozenset({'single', 'double', 'triple', 'home_run'})
+
+# 揮棒相關的 description 值 (Whiff Rate 分母)
+SWING_DESCS = np.array([
+    'swinging_strike', 'swinging_strike_blocked',
+    'foul', 'foul_tip', 'hit_into_play'
+])
+
+# 揮空 description 值 (Whiff Rate 分子)
+STRIKE_DESCS = np.array(['swinging_strike', 'swinging_strike_blocked'])
+
+# 季度診斷管線實際用到的 Statcast 欄位；需要其他欄位時在這裡擴充
+KEEP_COLUMNS = [
+    'game_date', 'game_type', 'events', 'description',
+    'launch_speed', 'launch_angle', 'hit_distance_sc',
+    'release_spin_rate', 'batter', 'pitcher'
+]
+
+# wOBA 權重 (2024 線性權重)
+WOBA_WEIGHTS = {
+    'walk': 0.690,
+    'hit_by_pitch': 0.722,
+    'single': 0.883,
+    'double': 1.244,
+    'triple': 1.569,
+    'home_run': 2.015
+}
+
+
+@lru_cache(maxsize=1024)
 def get_player_id(last_name: str, first_name: str) -> int:
     """
     查詢球員的 MLBAM ID
-    
+
+    姓名 → ID 的對照表長年穩定，因此查過的結果以 lru_cache 留在
+    行程內，並寫入 shelve 磁碟快取讓冷啟動也能跳過網路查詢。
+
     Args:
         last_name: 球員姓氏 (e.g., "Ohtani")
         first_name: 球員名字 (e.g., "Shohei")
-    
+
     Returns:
         int: 球員的 MLBAM ID
-    
+
     Raises:
         ValueError: 找不到球員
     """
+    key = f"{last_name.lower()},{first_name.lower()}"
+
+    try:
+        with shelve.open(_PLAYER_ID_DB) as cache:
+            if key in cache:
+                return cache[key]
+    except Exception:
+        pass  # 磁碟快取壞掉就直接查網路
+
     lookup = playerid_lookup(last_name, first_name)
-    
+
     if lookup.empty:
         raise ValueError(f"找不到球員: {first_name} {last_name}")
-    
-    player_id = lookup.iloc[0]['key_mlbam']
-    return int(player_id)
+
+    player_id = int(lookup.iloc[0]['key_mlbam'])
+
+    try:
+        with shelve.open(_PLAYER_ID_DB) as cache:
+            cache[key] = player_id
+    except Exception:
+        pass
+
+    return player_id
+
+
+def _month_chunks(start_date: str, end_date: str) -> list:
+    """把日期區間切成以月初為界的 (start, end) 子區間"""
+    start = pd.Timestamp(start_date)
+    end = pd.Timestamp(end_date)
+
+    points = [start]
+    for boundary in pd.date_range(start, end, freq='MS'):
+        if start < boundary <= end:
+            points.append(boundary)
+    points.append(end + pd.Timedelta(days=1))
+
+    return [
+        (lo.strftime('%Y-%m-%d'), (hi - pd.Timedelta(days=1)).strftime('%Y-%m-%d'))
+        for lo, hi in zip(points[:-1], points[1:])
+        if lo < hi
+    ]
 
 
 def fetch_statcast_data(player_id: int, start_date: str, end_date: str) -> pd.DataFrame:
     """
     抓取球員的 Statcast 逐球資料 (僅限例行賽)
-    
+
+    pybaseball 內部是逐日序列下載，整季一次要求會很慢；
+    這裡先切成月區間再併行抓取 (網路 I/O 為主，執行緒即可受益)。
+
     Args:
         player_id: MLBAM 球員 ID
         start_date: 開始日期 (YYYY-MM-DD)
         end_date: 結束日期 (YYYY-MM-DD)
-    
+
     Returns:
         pd.DataFrame: Statcast 資料 (僅例行賽)
     """
-    df = statcast_batter(start_date, end_date, player_id)
-    
+    chunks = _month_chunks(start_date, end_date)
+
+    if len(chunks) == 1:
+        df = statcast_batter(start_date, end_date, player_id)
+    else:
+        # max_workers 同時是併發上限，避免對 Statcast 端點塞太多請求
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            frames = list(executor.map(
+                lambda chunk: statcast_batter(chunk[0], chunk[1], player_id),
+                chunks
+            ))
+        frames = [f for f in frames if f is not None and not f.empty]
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
     if df.empty:
         raise ValueError(f"該期間沒有資料: {start_date} ~ {end_date}")
     
@@ -59,7 +158,19 @@ def fetch_statcast_data(player_id: int, start_date: str, end_date: str) -> pd.Da
         df = df[df['game_type'] == 'R']
         if df.empty:
             raise ValueError(f"該期間沒有例行賽資料: {start_date} ~ {end_date}")
-    
+
+    # 低基數字串欄轉 category：後續 ==/isin/value_counts 比較 int8 code 而非字串
+    for col in ('events', 'description', 'game_type'):
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+
+    # 日期在這裡一次轉好，下游切片不用重轉
+    df['game_date'] = pd.to_datetime(df['game_date'])
+
+    # Statcast 回傳約 90 欄，聚合只讀其中少數幾欄；
+    # 先投影可讓後續所有 O(rows × cols) 操作少搬 ~10 倍資料
+    df = df[[c for c in KEEP_COLUMNS if c in df.columns]]
+
     return df
 
 
@@ -68,146 +179,173 @@ def slice_by_game_index(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, p
     依據出賽序號切割資料為 Early/Mid/Late 三段
     
     Args:
-        df: 原始 Statcast 資料
-    
+        df: 原始 Statcast 資料 (不會被複製或修改)
+
     Returns:
         Tuple: (early_df, mid_df, late_df) 各 10 場比賽的資料
-    
+
     Raises:
         ValueError: 出賽場次不足 30 場
     """
-    df = df.copy()
-    df['game_date'] = pd.to_datetime(df['game_date'])
-    
-    game_dates = df['game_date'].drop_duplicates().sort_values().reset_index(drop=True)
-    n_games = len(game_dates)
-    
+    game_date = pd.to_datetime(df['game_date'])
+
+    # factorize 一趟同時產出每列的場次編號與不重複日期 (C 層級，免建 dict)
+    # game_index 只在切片時用到，保留為區域陣列即可，不寫回 df
+    game_index, unique_dates = pd.factorize(game_date, sort=True)
+    n_games = len(unique_dates)
+
     if n_games < 30:
         raise ValueError(f"樣本不足！該球員整季僅出賽 {n_games} 場，需至少 30 場。")
-    
-    game_index_map = {date: idx for idx, date in enumerate(game_dates)}
-    df['game_index'] = df['game_date'].map(game_index_map)
-    
+
     # Segment A (Early): 前 10 場
-    early_dates = game_dates[0:10].tolist()
-    early_df = df[df['game_date'].isin(early_dates)]
-    
+    early_df = df[game_index < 10]
+
     # Segment B (Mid): 中間 10 場
     mid_center = n_games // 2
     mid_start = mid_center - 5
     mid_end = mid_center + 5
-    mid_dates = game_dates[mid_start:mid_end].tolist()
-    mid_df = df[df['game_date'].isin(mid_dates)]
-    
+    mid_df = df[(game_index >= mid_start) & (game_index < mid_end)]
+
     # Segment C (Late): 最後 10 場
-    late_dates = game_dates[-10:].tolist()
-    late_df = df[df['game_date'].isin(late_dates)]
-    
+    late_df = df[game_index >= n_games - 10]
+
     return early_df, mid_df, late_df
 
 
+def _valid_values(series: pd.Series) -> np.ndarray:
+    """
+    一趟 isnan 掃描取出欄位的有效值 (float64 numpy 陣列)
+
+    同一欄的多個統計 (平均/最大/門檻計數) 共用這份過濾結果，
+    不必每個統計各自 dropna 再配置中間 Series。
+    """
+    arr = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    return arr[~np.isnan(arr)]
+
+
+def _event_counts(events: pd.Series) -> Dict[str, int]:
+    """
+    單次掃描統計各事件出現次數
+
+    categorical dtype 走快速路徑：np.bincount 直接在 int8 code 陣列上
+    累加 (C 層級的計數迴圈)，BABIP/wOBA 的加總隨後只需查表，
+    不必再掃描整欄。object dtype 則退回 value_counts。
+    """
+    if isinstance(events.dtype, pd.CategoricalDtype):
+        codes = events.cat.codes.to_numpy()
+        freq = np.bincount(codes[codes >= 0], minlength=len(events.cat.categories))
+        return {cat: int(n) for cat, n in zip(events.cat.categories, freq) if n}
+    return events.value_counts(dropna=True).to_dict()
+
+
 def aggregate_metrics(segment_df: pd.DataFrame, segment_name: str) -> Dict[str, Any]:
     """
     計算單一區段的 10 項關鍵指標
     
     Args:
-        segment_df: 該區段的資料
+        segment_df: 該區段的資料 (唯讀，不會被修改)
         segment_name: 區段名稱 (Early/Mid/Late)
-    
+
     Returns:
         Dict: 包含 10 項指標的字典
     """
-    df = segment_df.copy()
+    # 空區段直接回傳骨架，不必跑後面 20 多個聚合操作
+    # (下游圖表程式本來就容忍 None)
+    if segment_df.empty:
+        return {
+            'segment': segment_name,
+            'games': 0,
+            'plate_appearances': 0,
+            'avg_launch_speed': None,
+            'avg_launch_angle': None,
+            'hard_hit_rate': None,
+            'whiff_rate': None,
+            'max_hit_distance': None,
+            'avg_pitcher_spin': None,
+            'home_runs': 0,
+            'walks': 0,
+            'bb_rate': None,
+            'strikeouts': 0,
+            'k_rate': None,
+            'babip': None,
+            'woba': None,
+        }
+
+    df = segment_df
     
     metrics = {
         'segment': segment_name,
         'games': df['game_date'].nunique(),
-        'plate_appearances': len(df[df['events'].notna()]),
+        'plate_appearances': int(np.count_nonzero(df['events'].notna().to_numpy())),
     }
     
     # 1. 物理爆發力：launch_speed 平均值
-    valid_launch = df['launch_speed'].dropna()
-    metrics['avg_launch_speed'] = round(valid_launch.mean(), 2) if len(valid_launch) > 0 else None
-    
+    valid_launch = _valid_values(df['launch_speed'])
+    metrics['avg_launch_speed'] = round(float(valid_launch.mean()), 2) if valid_launch.size > 0 else None
+
     # 2. 擊球技巧：launch_angle 平均值
-    valid_angle = df['launch_angle'].dropna()
-    metrics['avg_launch_angle'] = round(valid_angle.mean(), 2) if len(valid_angle) > 0 else None
-    
-    # 3. 體能穩定性：Hard Hit Rate (launch_speed > 95 的比例)
-    if len(valid_launch) > 0:
-        hard_hits = (valid_launch > 95).sum()
-        metrics['hard_hit_rate'] = round(hard_hits / len(valid_launch) * 100, 2)
+    valid_angle = _valid_values(df['launch_angle'])
+    metrics['avg_launch_angle'] = round(float(valid_angle.mean()), 2) if valid_angle.size > 0 else None
+
+    # 3. 體能穩定性：Hard Hit Rate (launch_speed > 95 的比例，共用上面的過濾結果)
+    if valid_launch.size > 0:
+        hard_hits = np.count_nonzero(valid_launch > 95)
+        metrics['hard_hit_rate'] = round(hard_hits / valid_launch.size * 100, 2)
     else:
         metrics['hard_hit_rate'] = None
     
     # 4. 辨識能力：Whiff Rate (swinging_strike 比例)
-    total_swings = df[df['description'].isin([
-        'swinging_strike', 'swinging_strike_blocked', 
-        'foul', 'foul_tip', 'hit_into_play'
-    ])]
-    swinging_strikes = df[df['description'].isin(['swinging_strike', 'swinging_strike_blocked'])]
-    if len(total_swings) > 0:
-        metrics['whiff_rate'] = round(len(swinging_strikes) / len(total_swings) * 100, 2)
+    # 直接在 numpy 陣列上算次數，不建立列切片 DataFrame
+    desc = df['description'].to_numpy()
+    total_swings = np.count_nonzero(np.isin(desc, SWING_DESCS))
+    swinging_strikes = np.count_nonzero(np.isin(desc, STRIKE_DESCS))
+    if total_swings > 0:
+        metrics['whiff_rate'] = round(swinging_strikes / total_swings * 100, 2)
     else:
         metrics['whiff_rate'] = None
     
     # 5. 巔峰力量：hit_distance_sc 最大值
-    valid_distance = df['hit_distance_sc'].dropna()
-    metrics['max_hit_distance'] = round(valid_distance.max(), 2) if len(valid_distance) > 0 else None
-    
+    valid_distance = _valid_values(df['hit_distance_sc'])
+    metrics['max_hit_distance'] = round(float(valid_distance.max()), 2) if valid_distance.size > 0 else None
+
     # 6. 進壘威脅：release_spin_rate 平均值
-    valid_spin = df['release_spin_rate'].dropna()
-    metrics['avg_pitcher_spin'] = round(valid_spin.mean(), 2) if len(valid_spin) > 0 else None
-    
-    # 7-9. 事件統計
-    events = df['events'].dropna()
-    total_events = len(events)
+    valid_spin = _valid_values(df['release_spin_rate'])
+    metrics['avg_pitcher_spin'] = round(float(valid_spin.mean()), 2) if valid_spin.size > 0 else None
     
-    home_runs = (events == 'home_run').sum()
+    # 7-9. 事件統計 (單次掃描，避免逐事件重複掃描整欄)
+    counts = _event_counts(df['events'])
+    total_events = sum(counts.values())
+
+    home_runs = counts.get('home_run', 0)
     metrics['home_runs'] = int(home_runs)
-    
-    walks = (events == 'walk').sum()
+
+    walks = counts.get('walk', 0)
     metrics['walks'] = int(walks)
     metrics['bb_rate'] = round(walks / total_events * 100, 2) if total_events > 0 else None
-    
-    strikeouts = (events == 'strikeout').sum()
+
+    strikeouts = counts.get('strikeout', 0)
     metrics['strikeouts'] = int(strikeouts)
     metrics['k_rate'] = round(strikeouts / total_events * 100, 2) if total_events > 0 else None
-    
+
     # 10. 運氣成分：BABIP
-    hits = events.isin(['single', 'double', 'triple', 'home_run']).sum()
-    at_bats = events.isin([
-        'single', 'double', 'triple', 'home_run',
-        'field_out', 'strikeout', 'double_play', 
-        'grounded_into_double_play', 'force_out',
-        'fielders_choice', 'fielders_choice_out'
-    ]).sum()
-    sac_flies = (events == 'sac_fly').sum()
-    
+    hits = sum(counts.get(e, 0) for e in HIT_EVENTS)
+    at_bats = sum(counts.get(e, 0) for e in AT_BAT_EVENTS)
+    sac_flies = counts.get('sac_fly', 0)
+
     babip_numerator = hits - home_runs
     babip_denominator = at_bats - strikeouts - home_runs + sac_flies
-    
+
     if babip_denominator > 0:
         metrics['babip'] = round(babip_numerator / babip_denominator, 3)
     else:
         metrics['babip'] = None
-    
+
     # 計算 wOBA
-    woba_weights = {
-        'walk': 0.690,
-        'hit_by_pitch': 0.722,
-        'single': 0.883,
-        'double': 1.244,
-        'triple': 1.569,
-        'home_run': 2.015
-    }
-    
     woba_numerator = 0
-    for event, weight in woba_weights.items():
-        count = (events == event).sum()
-        woba_numerator += count * weight
-    
-    woba_denominator = at_bats + walks + (events == 'hit_by_pitch').sum() + sac_flies
+    for event, weight in WOBA_WEIGHTS.items():
+        woba_numerator += counts.get(event, 0) * weight
+
+    woba_denominator = at_bats + walks + counts.get('hit_by_pitch', 0) + sac_flies
     
     if woba_denominator > 0:
         metrics['woba'] = round(woba_numerator / woba_denominator, 3)
@@ -288,10 +426,15 @@ def get_full_analysis(last_name: str, first_name: str,
     # Step 3: 切片
     early_df, mid_df, late_df = slice_by_game_index(df)
     
-    # Step 4: 聚合指標
-    early_metrics = aggregate_metrics(early_df, "Early (前10場)")
-    mid_metrics = aggregate_metrics(mid_df, "Mid (季中10場)")
-    late_metrics = aggregate_metrics(late_df, "Late (最後10場)")
+    # Step 4: 聚合指標 (三段資料互相獨立，併行計算；pandas 的 C 層聚合會釋放 GIL)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        early_future = executor.submit(aggregate_metrics, early_df, "Early (前10場)")
+        mid_future = executor.submit(aggregate_metrics, mid_df, "Mid (季中10場)")
+        late_future = executor.submit(aggregate_metrics, late_df, "Late (最後10場)")
+
+        early_metrics = early_future.result()
+        mid_metrics = mid_future.result()
+        late_metrics = late_future.result()
     
     # Step 5: 封裝 JSON
     diagnosis = build_diagnosis_json(player_name, early_metrics, mid_metrics, late_metrics)
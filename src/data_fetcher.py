@@ -5,9 +5,190 @@ data_fetcher.py - 比賽資料抓取模組
 來源: ai棒球專案
 """
 
-from pybaseball import statcast, playerid_reverse_lookup
+from pybaseball import statcast, statcast_single_game, playerid_reverse_lookup
 import pandas as pd
+import pickle
+import requests
 from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+
+# Statcast 下載的磁碟快取目錄 (同日期區間只需下載一次)
+_CACHE_DIR = Path.home() / '.cache' / 'ai_baseball'
+_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+# 球員 ID → 姓名對照的磁碟快取 (跨行程累積)
+_PLAYER_NAME_CACHE = _CACHE_DIR / 'playerids.pkl'
+
+# MLB Stats API 賽程表端點 (查 game_pk 用，回傳僅數 KB 的 JSON)
+_SCHEDULE_API = 'https://statsapi.mlb.com/api/v1/schedule'
+
+# 比賽戰報與策略分析實際用到的 Statcast 欄位 (原始回傳約 90 欄)
+REQUIRED_COLS = [
+    'game_pk', 'game_date', 'home_team', 'away_team',
+    'inning', 'inning_topbot', 'outs_when_up',
+    'home_score', 'away_score', 'batter', 'pitcher', 'player_name',
+    'events', 'des', 'description', 'release_speed', 'pitch_type',
+    'launch_speed', 'launch_angle', 'hit_distance_sc',
+    'delta_run_exp', 'at_bat_number', 'zone'
+]
+
+
+# _narrow_statcast 的目標 dtype：低基數字串欄轉 category、物理量降為 float32
+_CATEGORY_COLS = ('events', 'pitch_type', 'home_team', 'away_team')
+_FLOAT32_COLS = ('release_speed', 'launch_speed', 'launch_angle',
+                 'hit_distance_sc', 'delta_run_exp')
+
+
+def _narrow_statcast(df: pd.DataFrame) -> pd.DataFrame:
+    """投影到必要欄位並縮小 dtype，記憶體與 parquet I/O 約少 6 倍"""
+    df = df[[c for c in REQUIRED_COLS if c in df.columns]].copy()
+
+    # 一次 astype 就地換完所有欄位，省去逐欄指派時重組 block 的成本
+    dtype_map = {c: 'category' for c in _CATEGORY_COLS if c in df.columns}
+    dtype_map.update({c: 'float32' for c in _FLOAT32_COLS if c in df.columns})
+
+    return df.astype(dtype_map, copy=False)
+
+
+@lru_cache(maxsize=128)
+def _lookup_batter_names(batter_ids: tuple):
+    """
+    playerid_reverse_lookup 的快取版本。
+
+    同一批打者在每次頁面互動都會重查 Chadwick Register (網路 + 數 MB
+    CSV 解析)；這裡以 ID tuple 做行程內 lru_cache，並把查過的對照
+    累積到 pickle 檔，之後的行程只需查缺少的 ID。
+    """
+    known = {}
+    try:
+        if _PLAYER_NAME_CACHE.exists():
+            with open(_PLAYER_NAME_CACHE, 'rb') as f:
+                known = pickle.load(f)
+    except Exception:
+        known = {}
+
+    missing = [bid for bid in batter_ids if bid not in known]
+    if missing:
+        lookup_df = playerid_reverse_lookup(missing, key_type='mlbam')
+        for _, row in lookup_df.iterrows():
+            known[row['key_mlbam']] = f"{row['name_first']} {row['name_last']}"
+        try:
+            with open(_PLAYER_NAME_CACHE, 'wb') as f:
+                pickle.dump(known, f)
+        except Exception:
+            pass  # 寫不進磁碟不影響本次查詢
+
+    return {bid: known[bid] for bid in batter_ids if bid in known}
+
+
+def _range_may_be_live(end_dt: str) -> bool:
+    """
+    該日期區間是否可能還有比賽進行中 (結束日為今天或昨天)。
+
+    進行中的日子抓到的是不完整資料，一旦落地就永遠回傳缺漏的
+    那一份；這種區間只走網路、不寫磁碟快取。
+    """
+    try:
+        end = datetime.strptime(end_dt, '%Y-%m-%d').date()
+    except ValueError:
+        return True  # 看不懂的日期一律當作可能未完賽，寧可不快取
+    return end >= datetime.now().date() - timedelta(days=1)
+
+
+def _cached_statcast(start_dt: str, end_dt: str):
+    """
+    statcast(start, end) 的磁碟快取版本。
+
+    以 (start, end) 命名 parquet 檔；命中時直接讀檔，
+    未命中才走網路並回寫快取。快取檔損毀時重新下載；
+    區間含今天/昨天時不落地，避免把不完整的一天凍結在快取裡。
+    """
+    cache_file = _CACHE_DIR / f"statcast_{start_dt}_{end_dt}.parquet"
+
+    if cache_file.exists():
+        try:
+            return pd.read_parquet(cache_file)
+        except Exception:
+            pass
+
+    df = statcast(start_dt=start_dt, end_dt=end_dt)
+
+    if df is not None and not df.empty:
+        df = _narrow_statcast(df)
+        if not _range_may_be_live(end_dt):
+            try:
+                df.to_parquet(cache_file, compression='zstd')
+            except Exception:
+                pass  # 寫不進快取不影響查詢結果
+
+    return df
+
+
+def _statcast_by_days(start_date: str, end_date: str):
+    """
+    逐日抓取並個別快取，再串成一個 DataFrame。
+
+    不同打者的回看視窗大量重疊，拆成日檔可讓 N 位打者 × 20 天
+    最多只需下載 20 個日檔，而不是 N 份幾乎相同的大區間。
+    """
+    frames = []
+    for day in pd.date_range(start_date, end_date, freq='D'):
+        day_str = day.strftime('%Y-%m-%d')
+        df = _cached_statcast(day_str, day_str)
+        if df is not None and not df.empty:
+            frames.append(df)
+
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+
+def _schedule_game_pk(game_date: str, team_code: str):
+    """
+    從 MLB Stats API 賽程表找出指定球隊當日的 game_pk。
+
+    賽程表只有幾 KB，先拿到 game_pk 就能只下載單場 statcast，
+    不必抓全聯盟一整天 (~15 場) 再過濾。
+    """
+    resp = requests.get(
+        _SCHEDULE_API,
+        params={'sportId': 1, 'date': game_date, 'hydrate': 'team'},
+        timeout=10,
+    )
+    resp.raise_for_status()
+
+    for date_info in resp.json().get('dates', []):
+        for game in date_info.get('games', []):
+            for side in ('home', 'away'):
+                team = game['teams'][side]['team']
+                if team.get('abbreviation') == team_code:
+                    return game['gamePk']
+    return None
+
+
+def _cached_single_game(game_pk, game_date: str):
+    """
+    statcast_single_game(game_pk) 的磁碟快取版本，做法同 _cached_statcast。
+    比賽日為今天/昨天時可能還在進行中，同樣不落地快取。
+    """
+    cache_file = _CACHE_DIR / f"statcast_game_{game_pk}.parquet"
+
+    if cache_file.exists():
+        try:
+            return pd.read_parquet(cache_file)
+        except Exception:
+            pass
+
+    df = statcast_single_game(game_pk)
+
+    if df is not None and not df.empty:
+        df = _narrow_statcast(df)
+        if not _range_may_be_live(game_date):
+            try:
+                df.to_parquet(cache_file, compression='zstd')
+            except Exception:
+                pass  # 寫不進快取不影響查詢結果
+
+    return df
 
 
 def get_game_data(game_date: str, team_code: str):
@@ -23,16 +204,30 @@ def get_game_data(game_date: str, team_code: str):
     """
     try:
         print(f"Fetching data for {game_date}...")
-        df = statcast(start_dt=game_date, end_dt=game_date)
-        
+
+        # Fast path: resolve the game_pk from the schedule API and pull
+        # just that game instead of the whole league day. Any hiccup
+        # (network, unknown code, API change) falls back to the day path.
+        try:
+            game_pk = _schedule_game_pk(game_date, team_code)
+            if game_pk is not None:
+                single_game_df = _cached_single_game(game_pk, game_date)
+                if single_game_df is not None and not single_game_df.empty:
+                    return single_game_df
+        except Exception as e:
+            print(f"Schedule lookup failed ({e}), falling back to full-day fetch...")
+
+        df = _cached_statcast(game_date, game_date)
+
         if df is None or df.empty:
             return None
-            
-        # Filter by team (home or away)
-        team_game_df = df[
-            (df['home_team'] == team_code) | 
-            (df['away_team'] == team_code)
-        ].copy()
+
+        # Filter by team (home or away): categorical compare + one isin pass
+        # over both columns; downstream only reads, so no defensive copy
+        df['home_team'] = df['home_team'].astype('category')
+        df['away_team'] = df['away_team'].astype('category')
+        mask = df[['home_team', 'away_team']].isin([team_code]).any(axis=1)
+        team_game_df = df[mask]
         
         if team_game_df.empty:
             return None
@@ -102,23 +297,50 @@ def get_batters_from_game(df: pd.DataFrame):
         return {}
     
     try:
-        lookup_df = playerid_reverse_lookup(batter_ids, key_type='mlbam')
-        
-        if lookup_df.empty:
-            return {}
-        
-        batters = {}
-        for _, row in lookup_df.iterrows():
-            batter_id = row['key_mlbam']
-            name = f"{row['name_first']} {row['name_last']}"
-            batters[batter_id] = name
-            
-        return batters
+        return dict(_lookup_batter_names(tuple(sorted(batter_ids))))
     except Exception as e:
         print(f"Error looking up batter names: {e}")
         return {}
 
 
+def get_players_history(batter_ids, game_date: str, days_back: int = 20):
+    """
+    Fetches historical Statcast data for several batters with one download.
+
+    One fetch + one groupby instead of a full range download per batter,
+    so a nine-man lineup costs a single pass over the window.
+
+    Args:
+        batter_ids: iterable of MLBAM player IDs.
+        game_date: Reference date (YYYY-MM-DD).
+        days_back: Number of days to look back.
+
+    Returns:
+        dict: {batter_id: DataFrame} for requested batters found in the window.
+    """
+    try:
+        end_date = datetime.strptime(game_date, '%Y-%m-%d')
+        start_date = end_date - timedelta(days=days_back)
+
+        print(f"Fetching history for {len(batter_ids)} batters from {start_date.date()} to {end_date.date()}...")
+
+        df = _statcast_by_days(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+
+        if df is None or df.empty:
+            return {}
+
+        wanted = set(batter_ids)
+        return {
+            batter_id: group
+            for batter_id, group in df.groupby('batter', sort=False)
+            if batter_id in wanted
+        }
+
+    except Exception as e:
+        print(f"Error fetching players history: {e}")
+        return {}
+
+
 def get_player_history(batter_id: int, game_date: str, days_back: int = 20):
     """
     Fetches historical Statcast data for a specific batter.
@@ -137,7 +359,7 @@ def get_player_history(batter_id: int, game_date: str, days_back: int = 20):
         
         print(f"Fetching history for batter {batter_id} from {start_date.date()} to {end_date.date()}...")
         
-        df = statcast(start_dt=start_date.strftime('%Y-%m-%d'), end_dt=end_date.strftime('%Y-%m-%d'))
+        df = _statcast_by_days(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
         
         if df is None or df.empty:
             return None
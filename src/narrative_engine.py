@@ -5,61 +5,223 @@ narrative_engine.py - 比賽敘事生成引擎
 來源: ai棒球專案
 """
 
+import asyncio
+import threading
+import numpy as np
 import pandas as pd
 import google.generativeai as genai
-import re
 import json
+from functools import lru_cache
+from google.api_core import exceptions as google_exceptions
+
+
+@lru_cache(maxsize=4)
+def _get_model(api_key: str):
+    """
+    Configures the SDK and constructs the Gemini model once per API key.
+    Rebuilding the model on every call re-initializes the HTTP client.
+    """
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel('gemini-2.5-flash')
+
+
+# All Gemini calls run on one long-lived loop in a daemon thread. The SDK
+# caches its async gRPC client globally and the channel binds to the loop
+# it first ran on; per-call asyncio.run would close that loop and every
+# later call would die with "Event loop is closed".
+_loop_lock = threading.Lock()
+_background_loop = None
+
+
+def _get_background_loop():
+    global _background_loop
+    with _loop_lock:
+        if _background_loop is None or _background_loop.is_closed():
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_background_loop.run_forever, daemon=True
+            ).start()
+        return _background_loop
+
+
+def _run_async(coro):
+    """Runs a coroutine on the persistent loop and blocks for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_background_loop()).result()
+
+# Event classes used for the quick batting-line accounting
+_HIT_SET = np.array(['single', 'double', 'triple', 'home_run'], dtype=object)
+_NON_AB_SET = np.array(['walk', 'hit_by_pitch', 'sac_fly', 'sac_bunt', 'catcher_interf'], dtype=object)
+
+# Placeholder strings some statcast dumps use for "no event"
+_NULL_EVENTS = ('null',)
+
+# Columns consumed when building key-moment dicts
+_MOMENT_COLUMNS = [
+    'game_date', 'inning', 'inning_topbot', 'outs_when_up',
+    'home_score', 'away_score', 'player_name', 'batter', 'pitcher',
+    'events', 'des', 'release_speed', 'pitch_type',
+    'launch_speed', 'launch_angle', 'hit_distance_sc'
+]
+
+# Per-moment prompt block, interpolated in one format_map pass per moment
+# instead of five f-string concatenations each
+_MOMENT_TEMPLATE = (
+    "Moment {i}:\n"
+    "- Context: {inning_topbot} of {inning}, {outs} outs. Score: Home {home_score} - Away {away_score}.\n"
+    "- Event: {event}\n"
+    "- Description: {description}\n"
+    "- Key Metrics: Pitch Speed {release_speed}mph, Pitch {pitch_type}, Exit Vel {launch_speed}mph, Angle {launch_angle}, Dist {hit_distance}ft.\n\n"
+)
+
+# Gemini quota guard: cap concurrent in-flight requests when fanning out
+_MAX_CONCURRENT_REQUESTS = 10
+_MAX_RETRIES = 3
+
+# Only quota/availability failures are worth retrying; auth or request
+# errors would fail identically three times and just delay the message
+_TRANSIENT_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+# Deterministic JSON output for both bilingual prompts: native JSON mode
+# plus a response schema means the reply is parse-ready in the happy path,
+# with no code fences or prose preamble to strip
+_BILINGUAL_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "english": {"type": "string"},
+        "chinese": {"type": "string"},
+    },
+    "required": ["english", "chinese"],
+}
+
+_BILINGUAL_GENERATION_CONFIG = genai.types.GenerationConfig(
+    temperature=0.3,
+    max_output_tokens=4096,
+    response_mime_type="application/json",
+    response_schema=_BILINGUAL_RESPONSE_SCHEMA,
+)
+
+
+def _nonzero_counts(series, top=None):
+    """
+    value_counts as a dict, without the zero-count entries a categorical
+    column reports for every category it has ever seen. Those zeros would
+    pad the prompt with league-wide pitch types the batter never faced.
+    """
+    vc = series.value_counts()
+    vc = vc[vc > 0]
+    if top is not None:
+        vc = vc.head(top)
+    return vc.to_dict()
+
+
+def _extract_json(text):
+    """
+    Parses the bilingual JSON payload out of a Gemini reply.
+
+    Native JSON mode makes a direct loads succeed in the common case;
+    otherwise slice from the first '{' to the last '}' — two O(N) scans
+    in C, no regex backtracking over multi-KB replies. If neither parses,
+    wrap the raw text so callers always get the english/chinese shape.
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+
+    start = text.find('{')
+    end = text.rfind('}')
+    if start != -1 and end > start:
+        try:
+            return json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            pass
+
+    return {"english": text, "chinese": ""}
+
+
+async def _generate_with_retry(model, prompt, generation_config=None):
+    """
+    Calls the async Gemini endpoint with exponential backoff.
+    Retries transient failures (429/5xx) up to _MAX_RETRIES times;
+    anything else propagates immediately.
+    """
+    delay = 1.0
+    for attempt in range(_MAX_RETRIES):
+        try:
+            return await model.generate_content_async(prompt, generation_config=generation_config)
+        except _TRANSIENT_ERRORS:
+            if attempt == _MAX_RETRIES - 1:
+                raise
+            await asyncio.sleep(delay)
+            delay *= 2
 
 
 def extract_key_moments(df: pd.DataFrame, top_n=5):
     """
     Identifies the top N key moments from the game data based on Run Expectancy/Leverage.
     """
-    action_plays = df[df['events'].notna() & (df['events'] != 'null')].copy()
-    
+    # One mask, one slice restricted to the columns actually consumed below;
+    # no .copy() — everything downstream reads or goes through .assign
+    events = df['events']
+    mask = events.notna() & ~events.isin(_NULL_EVENTS)
+    wanted = [c for c in _MOMENT_COLUMNS + ['delta_run_exp', 'at_bat_number'] if c in df.columns]
+    action_plays = df.loc[mask, wanted]
+
+
     if action_plays.empty:
         return [], {}
     
-    # Sort by absolute change in run expectancy (impact)
+    # Keep the top N by absolute change in run expectancy (impact);
+    # nlargest is a partial selection, no need to sort every play
     if 'delta_run_exp' in action_plays.columns:
-        action_plays['importance'] = action_plays['delta_run_exp'].abs()
+        top_plays = action_plays.assign(
+            importance=action_plays['delta_run_exp'].abs()
+        ).nlargest(top_n, 'importance')
     else:
-        action_plays['importance'] = 0
-    
-    top_plays = action_plays.sort_values(by='importance', ascending=False).head(top_n)
-    
+        top_plays = action_plays.head(top_n)
+
     if 'at_bat_number' in top_plays.columns:
         top_plays = top_plays.sort_values('at_bat_number')
         
-    moments = []
-    for _, play in top_plays.iterrows():
-        moment = {
-            "game_date": play.get("game_date"),
-            "inning": play.get("inning"),
-            "inning_topbot": play.get("inning_topbot"),
-            "outs": play.get("outs_when_up"),
-            "home_score": play.get("home_score"),
-            "away_score": play.get("away_score"),
-            "batter": play.get("player_name") if 'player_name' in play else play.get("batter"), 
-            "pitcher": play.get("pitcher"), 
-            "event": play.get("events"),
-            "description": play.get("des"),
+    # Column-wise extraction: to_dict('records') avoids the per-row Series
+    # boxing that iterrows would pay for every cell
+    cols = top_plays[[c for c in _MOMENT_COLUMNS if c in top_plays.columns]]
+    moments = [
+        {
+            "game_date": record.get("game_date"),
+            "inning": record.get("inning"),
+            "inning_topbot": record.get("inning_topbot"),
+            "outs": record.get("outs_when_up"),
+            "home_score": record.get("home_score"),
+            "away_score": record.get("away_score"),
+            "batter": record.get("player_name") if "player_name" in record else record.get("batter"),
+            "pitcher": record.get("pitcher"),
+            "event": record.get("events"),
+            "description": record.get("des"),
             "metrics": {
-                "release_speed": play.get("release_speed"),
-                "pitch_type": play.get("pitch_type"),
-                "launch_speed": play.get("launch_speed"),
-                "launch_angle": play.get("launch_angle"),
-                "hit_distance": play.get("hit_distance_sc")
+                "release_speed": record.get("release_speed"),
+                "pitch_type": record.get("pitch_type"),
+                "launch_speed": record.get("launch_speed"),
+                "launch_angle": record.get("launch_angle"),
+                "hit_distance": record.get("hit_distance_sc")
             }
         }
-        moments.append(moment)
-        
+        for record in cols.to_dict(orient='records')
+    ]
+
     # Extract metadata
     final_home = df['home_score'].max()
     final_away = df['away_score'].max()
     
-    home_team = df.iloc[0].get("home_team", "Home")
-    away_team = df.iloc[0].get("away_team", "Away")
+    # Scalar .iat lookup: df.iloc[0] would box the whole first row into a
+    # mixed-dtype Series just to read two cells
+    home_team = df['home_team'].iat[0] if 'home_team' in df.columns else 'Home'
+    away_team = df['away_team'].iat[0] if 'away_team' in df.columns else 'Away'
     
     if final_home > final_away:
         result = f"{home_team} wins"
@@ -80,16 +242,23 @@ def extract_key_moments(df: pd.DataFrame, top_n=5):
 
 
 def generate_game_narrative(moments, metadata, api_key):
+    """
+    Synchronous wrapper around generate_game_narrative_async.
+    """
+    return _run_async(generate_game_narrative_async(moments, metadata, api_key))
+
+
+async def generate_game_narrative_async(moments, metadata, api_key):
     """
     Generates a narrative using Google Gemini API based on the extracted moments.
-    Returns bilingual (English/Chinese) narrative.
+    Returns bilingual (English/Chinese) narrative. The request is network-bound,
+    so callers analyzing several games can gather these coroutines concurrently.
     """
     if not moments:
         return "No key moments found for this game."
         
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.5-flash')
+        model = _get_model(api_key)
     except Exception as e:
         return f"Error configuring Gemini API: {e}"
     
@@ -115,75 +284,98 @@ def generate_game_narrative(moments, metadata, api_key):
     """
     
     # User Prompt
-    matchup_info = f"MATCHUP: {metadata.get('away_team')} (Visiting) @ {metadata.get('home_team')} (Home)\n"
-    matchup_info += f"FINAL RESULT: {metadata.get('result')}. Score: {metadata.get('away_team')} {metadata.get('away_score')} - {metadata.get('home_team')} {metadata.get('home_score')}\n"
-    
-    user_prompt = f"{system_prompt.format(home_team=metadata.get('home_team'), away_team=metadata.get('away_team'))}\n\n{matchup_info}\nHere are the key moments from the game:\n\n"
-    
-    for i, m in enumerate(moments, 1):
-        metrics = m['metrics']
-        user_prompt += f"Moment {i}:\n"
-        user_prompt += f"- Context: {m['inning_topbot']} of {m['inning']}, {m['outs']} outs. Score: Home {m['home_score']} - Away {m['away_score']}.\n"
-        user_prompt += f"- Event: {m['event']}\n"
-        user_prompt += f"- Description: {m['description']}\n"
-        user_prompt += f"- Key Metrics: Pitch Speed {metrics.get('release_speed')}mph, Pitch {metrics.get('pitch_type')}, Exit Vel {metrics.get('launch_speed')}mph, Angle {metrics.get('launch_angle')}, Dist {metrics.get('hit_distance')}ft.\n\n"
-        
-    user_prompt += "Write the narrative in strictly valid JSON."
+    matchup_info = (
+        f"MATCHUP: {metadata.get('away_team')} (Visiting) @ {metadata.get('home_team')} (Home)\n"
+        f"FINAL RESULT: {metadata.get('result')}. Score: {metadata.get('away_team')} {metadata.get('away_score')} - {metadata.get('home_team')} {metadata.get('home_score')}\n"
+    )
     
+    moment_blocks = "".join(
+        _MOMENT_TEMPLATE.format_map({**m, **m['metrics'], 'i': i})
+        for i, m in enumerate(moments, 1)
+    )
+
+    user_prompt = (
+        f"{system_prompt.format(home_team=metadata.get('home_team'), away_team=metadata.get('away_team'))}\n\n"
+        f"{matchup_info}\nHere are the key moments from the game:\n\n"
+        f"{moment_blocks}"
+        "Write the narrative in strictly valid JSON."
+    )
+
     try:
-        response = model.generate_content(user_prompt)
-        
-        text = response.text
-        
-        # JSON extraction
-        match = re.search(r'\{.*\}', text, re.DOTALL)
-        if match:
-            try:
-                return json.loads(match.group(0))
-            except json.JSONDecodeError:
-                pass
-        
-        cleaned_text = text.strip()
-        if cleaned_text.startswith("```json"):
-            cleaned_text = cleaned_text[7:]
-        elif cleaned_text.startswith("```"):
-            cleaned_text = cleaned_text[3:]
-            
-        if cleaned_text.endswith("```"):
-            cleaned_text = cleaned_text[:-3]
-            
-        return json.loads(cleaned_text.strip())
-            
+        response = await _generate_with_retry(model, user_prompt, _BILINGUAL_GENERATION_CONFIG)
+        return _extract_json(response.text)
+
     except Exception as e:
-        return {"english": response.text if 'response' in locals() else str(e), "chinese": "Could not parse Chinese translation from AI response."}
+        return {"english": f"Error generating narrative: {e}", "chinese": ""}
 
 
 def generate_player_analysis(game_df, history_df, player_name, api_key):
+    """
+    Synchronous wrapper around generate_player_analysis_async.
+    """
+    return _run_async(generate_player_analysis_async(game_df, history_df, player_name, api_key))
+
+
+def generate_player_analyses(requests, api_key):
+    """
+    Synchronous wrapper around generate_player_analyses_async.
+    """
+    return _run_async(generate_player_analyses_async(requests, api_key))
+
+
+async def generate_player_analyses_async(requests, api_key):
+    """
+    Analyzes several batters concurrently.
+
+    Args:
+        requests: iterable of (game_df, history_df, player_name) tuples.
+
+    Returns:
+        list: one analysis dict per request, in input order.
+    """
+    semaphore = asyncio.Semaphore(_MAX_CONCURRENT_REQUESTS)
+
+    async def _bounded(game_df, history_df, player_name):
+        async with semaphore:
+            return await generate_player_analysis_async(game_df, history_df, player_name, api_key)
+
+    return await asyncio.gather(*[_bounded(*request) for request in requests])
+
+
+async def generate_player_analysis_async(game_df, history_df, player_name, api_key):
     """
     Generates an analysis of the pitching strategy used against a specific batter.
     Returns bilingual analysis.
     """
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.5-flash')
+        model = _get_model(api_key)
     except Exception as e:
         return {"english": f"Error configuring Gemini API: {e}", "chinese": ""}
     
-    # Summarize Today's Game
-    today_pitch_counts = game_df['pitch_type'].value_counts().to_dict() if 'pitch_type' in game_df.columns else {}
-    today_results = game_df['events'].dropna().tolist() if 'events' in game_df.columns else []
-    today_zones = game_df['zone'].value_counts().to_dict() if 'zone' in game_df.columns else {}
+    # Summarize Today's Game, capped so the prompt stays a fixed size:
+    # a batter faces a handful of pitch types/zones, and only the latest
+    # outcomes matter — fewer input tokens means faster, cheaper calls
+    today_pitch_counts = _nonzero_counts(game_df['pitch_type'], top=8) if 'pitch_type' in game_df.columns else {}
+    today_results = game_df['events'].dropna().tail(20).tolist() if 'events' in game_df.columns else []
+    today_zones = _nonzero_counts(game_df['zone'], top=8) if 'zone' in game_df.columns else {}
     
-    # Summarize History
+    # Summarize History: pull the events column out once and run all four
+    # reductions over the same cache-resident array instead of re-scanning
+    # the DataFrame per statistic
     if history_df is not None and not history_df.empty:
-        hist_pitch_counts = history_df['pitch_type'].value_counts().to_dict() if 'pitch_type' in history_df.columns else {}
-        hist_events = history_df[history_df['events'].notna()]['events'] if 'events' in history_df.columns else []
-        hits = hist_events.isin(['single', 'double', 'triple', 'home_run']).sum()
-        at_bats = (~hist_events.isin(['walk', 'hit_by_pitch', 'sac_fly', 'sac_bunt', 'catcher_interf'])).sum()
+        hist_pitch_counts = _nonzero_counts(history_df['pitch_type']) if 'pitch_type' in history_df.columns else {}
+        if 'events' in history_df.columns:
+            hist_events = history_df['events'].to_numpy()
+            hist_events = hist_events[pd.notna(hist_events)]
+        else:
+            hist_events = np.empty(0, dtype=object)
+
+        hits = int(np.isin(hist_events, _HIT_SET).sum())
+        at_bats = int((~np.isin(hist_events, _NON_AB_SET)).sum())
         recent_avg = round(hits / at_bats, 3) if at_bats > 0 else 0
-        
-        hist_hr = (hist_events == 'home_run').sum()
-        hist_k = (hist_events == 'strikeout').sum()
+
+        hist_hr = int((hist_events == 'home_run').sum())
+        hist_k = int((hist_events == 'strikeout').sum())
     else:
         hist_pitch_counts = {}
         recent_avg = "N/A"
@@ -225,18 +417,8 @@ Analyze the strategy and provide the JSON output.
 """
     
     try:
-        response = model.generate_content(user_prompt)
-        
-        text = response.text
-        
-        match = re.search(r'\{.*\}', text, re.DOTALL)
-        if match:
-            try:
-                return json.loads(match.group(0))
-            except json.JSONDecodeError:
-                pass
-        
-        return json.loads(text.strip())
-        
+        response = await _generate_with_retry(model, user_prompt, _BILINGUAL_GENERATION_CONFIG)
+        return _extract_json(response.text)
+
     except Exception as e:
         return {"english": f"Error generating analysis: {e}", "chinese": ""}
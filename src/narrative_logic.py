@@ -7,6 +7,8 @@ narrative_logic.py - AI 季度敘事引擎
 
 import os
 import json
+import hashlib
+from functools import lru_cache
 from typing import Dict
 from pathlib import Path
 from dotenv import load_dotenv
@@ -71,6 +73,13 @@ ANALYSIS_PROMPT_TEMPLATE = """幫我用「跟朋友聊天」的方式，介紹 *
 - 語氣自然但不廢話"""
 
 
+@lru_cache(maxsize=4)
+def _build_model(api_key: str):
+    """同一把 API Key 只設定/建構模型一次，省去每次呼叫的 SDK 初始化"""
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel('gemini-2.5-flash')
+
+
 def configure_gemini(api_key: str = None):
     """
     設定 Gemini API
@@ -78,15 +87,14 @@ def configure_gemini(api_key: str = None):
     """
     if not api_key:
         api_key = os.getenv('OPENAI_API_KEY')
-    
+
     if not api_key or api_key == 'your_gemini_api_key_here':
         raise ValueError(
             "請提供 Gemini API Key！\n"
             "可以在 Sidebar 輸入，或在 .env 檔案中設定 OPENAI_API_KEY"
         )
-    
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel('gemini-2.5-flash')
+
+    return _build_model(api_key)
 
 
 def _translate_trend(trend: str) -> str:
@@ -100,23 +108,25 @@ def _translate_trend(trend: str) -> str:
     return translations.get(trend, trend)
 
 
-def generate_season_narrative(diagnosis_json: Dict, season_year: str = "2024", api_key: str = None) -> str:
-    """
-    使用 Gemini API 生成季度診斷報告
-    
-    Args:
-        diagnosis_json: 由 data_engine 產生的診斷 JSON
-        season_year: 賽季年份 (預設 2024)
-        api_key: Gemini API Key (可選，若無則使用環境變數)
-    
-    Returns:
-        str: AI 生成的診斷報告
-    """
-    model = configure_gemini(api_key)
-    
+# 同一份診斷 JSON 在 Streamlit 重跑時會反覆進來；以內容雜湊為鍵
+# 快取格式化結果，省掉每次重跑的三段 json.dumps 與範本插值
+_PROMPT_CACHE: Dict[tuple, str] = {}
+
+
+def _build_prompt(diagnosis_json: Dict, season_year: str) -> str:
+    """組出季度分析 Prompt，相同診斷內容直接回傳快取字串"""
+    digest = hashlib.blake2b(
+        repr(diagnosis_json).encode(), digest_size=16
+    ).hexdigest()
+    key = (digest, season_year)
+
+    cached = _PROMPT_CACHE.get(key)
+    if cached is not None:
+        return cached
+
     analysis_segments = diagnosis_json['analysis_segments']
     summary = diagnosis_json['summary']
-    
+
     prompt = ANALYSIS_PROMPT_TEMPLATE.format(
         season_year=season_year,
         player_name=diagnosis_json['player_name'],
@@ -127,7 +137,29 @@ def generate_season_narrative(diagnosis_json: Dict, season_year: str = "2024", a
         hard_hit_trend=_translate_trend(summary['hard_hit_trend']),
         k_rate_trend=_translate_trend(summary['k_rate_trend'])
     )
+
+    if len(_PROMPT_CACHE) > 64:
+        _PROMPT_CACHE.clear()
+    _PROMPT_CACHE[key] = prompt
+    return prompt
+
+
+def generate_season_narrative(diagnosis_json: Dict, season_year: str = "2024", api_key: str = None) -> str:
+    """
+    使用 Gemini API 生成季度診斷報告
     
+    Args:
+        diagnosis_json: 由 data_engine 產生的診斷 JSON
+        season_year: 賽季年份 (預設 2024)
+        api_key: Gemini API Key (可選，若無則使用環境變數)
+    
+    Returns:
+        str: AI 生成的診斷報告
+    """
+    model = configure_gemini(api_key)
+
+    prompt = _build_prompt(diagnosis_json, season_year)
+
     try:
         response = model.generate_content(
             [SCOUT_SYSTEM_PROMPT, prompt],